@@ -1,8 +1,10 @@
 import logging
 import os
+import queue
 import sys
 import traceback
-from logging.handlers import RotatingFileHandler
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import Optional
 from unittest.mock import patch
 
 import pyqtgraph as pg
@@ -10,6 +12,7 @@ from PyQt5.QtCore import QSettings, QStandardPaths
 from PyQt5.QtWidgets import QApplication
 
 from smartinertia import __version__
+from smartinertia.settings import SettingsCache
 from smartinertia.window import MainWindow
 
 # logging configuration
@@ -24,8 +27,12 @@ ch.setFormatter(formatter)
 log.addHandler(ch)
 
 
-def setup_file_logging():
-    """Setup logging into files."""
+def setup_file_logging() -> Optional[QueueListener]:
+    """Setup logging into files.
+
+    Records are passed through a queue to a background listener, which writes
+    them to the file as they arrive, so logging never waits on file I/O.
+    """
     log_dir = QStandardPaths.writableLocation(QStandardPaths.AppLocalDataLocation)
     log_path = os.path.join(log_dir, "smartinertia.log")
     log.info(f"Log file location: {log_path}")
@@ -41,9 +48,15 @@ def setup_file_logging():
         fh = RotatingFileHandler(log_path, maxBytes=int(1e7), backupCount=5)
         fh.setLevel(logging.INFO)
         fh.setFormatter(formatter)
-        log.addHandler(fh)
     except (PermissionError, FileNotFoundError):
         log.exception(f"Could not open log file.")
+        return None
+
+    log_queue = queue.Queue(-1)
+    listener = QueueListener(log_queue, fh)
+    log.addHandler(QueueHandler(log_queue))
+    listener.start()
+    return listener
 
 
 # pyqtgraph color configuration
@@ -66,15 +79,18 @@ def main():
     app.setApplicationName("SmartInertia")
 
     # setup logging to file
-    setup_file_logging()
+    log_listener = setup_file_logging()
 
     # setup settings
     log.info("Opening settings.")
     setting = QSettings('SmartInertia', __version__)
     log.info(f"Settings location: {setting.fileName()}.")
+    # values are cached in memory and only written out once on exit
+    settings_cache = SettingsCache(setting)
+    app.aboutToQuit.connect(settings_cache.flush)
 
     log.info("Opening the main window.")
-    gui = MainWindow(setting)
+    gui = MainWindow(settings_cache)
     gui.show()
     try:
         with patch('sys.excepthook', excepthook):
@@ -83,6 +99,10 @@ def main():
         log.exception("Exception in main thread!")
     log.info("Close the main window.")
 
+    # write out the queued records
+    if log_listener is not None:
+        log_listener.stop()
+
 
 if __name__ == '__main__':
     main()
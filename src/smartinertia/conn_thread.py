@@ -1,30 +1,146 @@
 import logging
-from typing import Callable
+import os
+from time import monotonic
+from typing import List, Optional
 
-from PyQt5.QtCore import QThread, pyqtSignal
+import numpy as np
+from PyQt5.QtCore import QObject, QSocketNotifier, QThread, pyqtSignal
+from serial import SerialException
 
 from smartinertia.connection import Connection
 
 log = logging.getLogger(__name__)
 
+# samples are sent to gui in batches of at least BATCH_SIZE or after BATCH_INTERVAL seconds
+BATCH_SIZE = 32
+BATCH_INTERVAL = 0.02
+# most bytes the notifier reads at once, more than the sensor sends between two event loop passes
+READ_SIZE = 4096
+
+
+def parse_lines(lines: List[bytes]) -> np.ndarray:
+    """Parse `<time>,<frequency>` lines into an array with one sample per row."""
+    # the joined lines can only be split back into samples if each line has one separator
+    if all(line.count(b',') == 1 for line in lines):
+        try:
+            values = np.fromstring(b','.join(lines), sep=',')
+            if values.size == 2 * len(lines):
+                return values.reshape(-1, 2)
+        except ValueError:
+            pass
+
+    # some line is malformed, parse them one by one to only skip the bad ones
+    points = []
+    for line in lines:
+        try:
+            t, f = line.split(b',')
+            points.append((float(t), float(f)))
+        except ValueError:
+            pass
+    return np.array(points, dtype=np.float64).reshape(-1, 2)
+
+
+def feed_points(con: Connection, data: bytes) -> np.ndarray:
+    """Parse the bytes received on the connection into completely received samples."""
+    if con.binary:
+        return con.feed_frames(data)
+
+    lines = con.feed_lines(data)
+    if not lines:
+        return np.empty((0, 2))
+    return parse_lines(lines)
+
+
+def read_points(con: Connection) -> np.ndarray:
+    """Read and parse the samples waiting on the connection."""
+    return feed_points(con, con.read())
+
 
 class ConnectionThread(QThread):
     """This thread reads data send over serial and sends it to gui."""
-    sig = pyqtSignal(tuple)
+    sig = pyqtSignal(object)
+    # reading stopped because the port failed
+    failed = pyqtSignal()
 
-    def __init__(self, con: Connection, sig_receiver: Callable) -> None:
+    def __init__(self, con: Connection) -> None:
         super().__init__()
         self.con = con
-        self.sig.connect(sig_receiver)
         self.stop = False
         log.info("Create connection thread.")
 
+    def start(self, priority: QThread.Priority = QThread.HighPriority):
+        """Start the thread, above normal priority so painting the gui can't delay the reads."""
+        super().start(priority)
+
     def run(self):
         """This function is run when the thread starts. The thread stops if this function returns."""
+        batch = []
+        batch_len = 0
+        last_emit = monotonic()
         while not self.stop:
             try:
-                line = self.con.readline()
-                t, f = line.split(b',')
-                self.sig.emit((float(t), float(f)))
-            except:
-                pass
+                points = read_points(self.con)
+            except (SerialException, OSError, TypeError):
+                # the port was closed or disconnected, a read racing with close
+                # can also fail on the invalidated file descriptor
+                if not self.stop:
+                    log.exception("Reading from connection failed!")
+                    self.failed.emit()
+                break
+            if len(points):
+                batch.append(points)
+                batch_len += len(points)
+
+            # one signal per batch keeps the cross thread traffic low
+            if batch_len >= BATCH_SIZE or (batch_len and monotonic() - last_emit >= BATCH_INTERVAL):
+                self.sig.emit(np.concatenate(batch))
+                batch = []
+                batch_len = 0
+                last_emit = monotonic()
+
+
+class ConnectionNotifier(QObject):
+    """Reads data send over serial in the gui event loop whenever the port is readable.
+
+    Has the same interface as ConnectionThread, but needs a port with a file
+    descriptor, so it only works on POSIX.
+    """
+    sig = pyqtSignal(object)
+    failed = pyqtSignal()
+
+    def __init__(self, con: Connection) -> None:
+        super().__init__()
+        self.con = con
+        self.notifier = None  # type: Optional[QSocketNotifier]
+        log.info("Create connection notifier.")
+
+    @property
+    def stop(self) -> bool:
+        return self.notifier is None or not self.notifier.isEnabled()
+
+    @stop.setter
+    def stop(self, value: bool):
+        # the notifier must be disabled before the port is closed
+        if self.notifier is not None:
+            self.notifier.setEnabled(not value)
+
+    def start(self):
+        self.notifier = QSocketNotifier(self.con.ser.fileno(), QSocketNotifier.Read)
+        self.notifier.activated.connect(self._read)
+
+    def _read(self):
+        try:
+            # the port is non-blocking, so one syscall takes all the bytes that arrived
+            data = os.read(self.con.ser.fileno(), READ_SIZE)
+            if not data:
+                raise SerialException("Port was disconnected.")
+            points = feed_points(self.con, data)
+        except BlockingIOError:
+            return
+        except (SerialException, OSError, TypeError):
+            log.exception("Reading from connection failed!")
+            self.stop = True
+            self.failed.emit()
+            return
+        if len(points):
+            self.sig.emit(points)
@@ -1,14 +1,28 @@
 import logging
 import os
-from time import sleep
+from time import monotonic, sleep
+from typing import List, Optional
 
+import numpy as np
 from serial import Serial
 from serial.tools.list_ports import grep
 
 log = logging.getLogger(__name__)
 
+# binary frames are a sync byte, time and frequency as little-endian float32
+# and a checksum byte, the xor of the time and frequency bytes
+FRAME_SYNC = 0xA5
+FRAME_DTYPE = np.dtype([('sync', 'u1'), ('t', '<f4'), ('f', '<f4'), ('check', 'u1')])
+# most seconds between two samples of a run, frames further apart are corrupted
+MAX_FRAME_GAP = 60.
 
-def get_ports():
+# seconds for which get_cached_ports reuses the last enumeration of the ports
+PORTS_TTL = 5
+_cached_ports = []  # type: List[str]
+_cached_ports_time = None  # type: Optional[float]
+
+
+def get_ports() -> List[str]:
     """Get available serial connections."""
     serial_ports = []
     if os.name == 'nt':
@@ -20,30 +34,120 @@ def get_ports():
     serial_ports = [p.device for p in serial_ports]
     log.info(f"Available serial ports: {','.join(serial_ports)}.")
 
+    global _cached_ports, _cached_ports_time
+    _cached_ports, _cached_ports_time = serial_ports, monotonic()
     return serial_ports
 
 
+def get_cached_ports() -> List[str]:
+    """Get available serial connections, enumerated at most PORTS_TTL seconds ago."""
+    if _cached_ports_time is None or monotonic() - _cached_ports_time > PORTS_TTL:
+        return get_ports()
+    return list(_cached_ports)
+
+
 class Connection:
-    """Object to hold the serial connection."""
-    def __init__(self, port, baud=9600, timeout=1):
+    """Object to hold the serial connection.
+
+    The sensor either sends `<time>,<frequency>` text lines or, with binary set,
+    fixed size FRAME_DTYPE frames.
+    """
+    def __init__(self, port, baud=9600, timeout=1, binary=False):
         self.ser = Serial()
         self.ser.port = port
         self.ser.baudrate = baud
         self.ser.timeout = timeout
-        log.info(f"Create connection to {port} with {baud}.")
+        self.binary = binary
+        # bytes of a line or frame that has not been completely received yet
+        self._buf = bytearray()
+        # time of the last accepted frame
+        self._last_t = None  # type: Optional[float]
+        log.info(f"Create {'binary' if binary else 'text'} connection to {port} with {baud}.")
 
     def open(self):
         self.ser.open()
         sleep(0.1)
         self.ser.reset_input_buffer()
         self.ser.reset_output_buffer()
+        self._buf = bytearray()
+        self._last_t = None
         log.info(f"Open connection to {self.ser.port}.")
 
-    def readline(self):
-        l = self.ser.readline()
-        while not l:
-            l = self.ser.readline()
-        return l
+    def reset(self):
+        """Discard everything received while no run was reading the port, it stays open."""
+        self.ser.reset_input_buffer()
+        self._buf = bytearray()
+        self._last_t = None
+        # win32 ignores a failed purge, but asking for the waiting bytes fails on a stale handle
+        log.info(f"Reset connection to {self.ser.port}, {self.ser.in_waiting} bytes waiting.")
+
+    def read(self) -> bytes:
+        """Read everything waiting on the port, blocks until at least one byte or timeout."""
+        return self.ser.read(max(1, self.ser.in_waiting))
+
+    def cancel_read(self):
+        """Make a read blocked in another thread return right away."""
+        self.ser.cancel_read()
+
+    def feed_lines(self, data: bytes) -> List[bytearray]:
+        """Add received bytes and return the lines that are now completely received."""
+        self._buf += data
+        *lines, self._buf = self._buf.split(b'\n')
+        return lines
+
+    def feed_frames(self, data: bytes) -> np.ndarray:
+        """Add received bytes and return the completely received frames, one sample per row."""
+        self._buf += data
+        points = []
+        start = 0
+        while len(self._buf) - start >= FRAME_DTYPE.itemsize:
+            # decode all the complete frames at once, they are valid up to the first one
+            # out of sync or with a wrong checksum
+            count = (len(self._buf) - start) // FRAME_DTYPE.itemsize
+            frames = np.frombuffer(self._buf, dtype=FRAME_DTYPE, count=count, offset=start)
+            frame_bytes = np.frombuffer(self._buf, dtype=np.uint8, count=count * FRAME_DTYPE.itemsize,
+                                        offset=start).reshape(count, FRAME_DTYPE.itemsize)
+            checksum = np.bitwise_xor.reduce(frame_bytes[:, 1:-1], axis=1)
+            out_of_sync = np.flatnonzero((frames['sync'] != FRAME_SYNC) | (frames['check'] != checksum))
+            n_valid = out_of_sync[0] if len(out_of_sync) else len(frames)
+            if n_valid:
+                points.append(np.column_stack([frames['t'][:n_valid], frames['f'][:n_valid]]))
+                start += n_valid * FRAME_DTYPE.itemsize
+            # the buffer can't be resized while numpy still looks at it
+            del frames, frame_bytes
+            if not len(out_of_sync):
+                break
+            # out of sync, skip to the next sync byte
+            start = self._buf.find(FRAME_SYNC, start + 1)
+            if start == -1:
+                start = len(self._buf)
+        del self._buf[:start]
+        if not points:
+            return np.empty((0, 2))
+        return self._check_times(np.concatenate(points).astype(np.float64))
+
+    def _check_times(self, points: np.ndarray) -> np.ndarray:
+        """Keep the samples whose time follows the last accepted one, a corrupted frame can hold any value."""
+        t = points[:, 0]
+        gaps = np.diff(t, prepend=t[0] if self._last_t is None else self._last_t)
+        valid = np.isfinite(points).all(axis=1) & (gaps > 0) & (gaps <= MAX_FRAME_GAP)
+        if self._last_t is None:
+            valid[0] = np.isfinite(points[0]).all()
+        if valid.all():
+            self._last_t = t[-1]
+            return points
+
+        # a bad sample also makes the gap after it look wrong, so check them one by one
+        keep = []
+        for i, (time, frequency) in enumerate(points.tolist()):
+            if not (np.isfinite(time) and np.isfinite(frequency)):
+                continue
+            if self._last_t is not None and not 0 < time - self._last_t <= MAX_FRAME_GAP:
+                continue
+            keep.append(i)
+            self._last_t = time
+        log.warning(f"Dropped {len(points) - len(keep)} samples with invalid values.")
+        return points[keep]
 
     def close(self):
         try:
@@ -1,251 +1,441 @@
 import logging
 from collections import namedtuple
-from typing import Optional, List
 from datetime import datetime
+from typing import List, Optional, Tuple
 
 import numpy as np
+from PyQt5.QtCore import QObject, QRunnable, Qt, QThreadPool, pyqtSignal
 from PyQt5.QtWidgets import QMessageBox
-from scipy.signal import argrelmax, butter, filtfilt
+from scipy.signal import butter, sosfilt_zi, sosfiltfilt
 
 from smartinertia.dialogs import ReportDialog, RunConf
-from smartinertia.save import save_data, save_run, save_run_more
+from smartinertia.save import (DailyWorkbookWriter, save_data,
+                               save_in_background, save_run_more)
 
 START_RUNS = 3
 COUNTED_RUNS = 6
 
 MIN_FREQ_START = 2
-SAMPLES_FOR_FILTER = 30
+# seconds of samples to pass through the filter before its output is used
+SETTLE_TIME = 0.2
 
 SAMPLING_FREQ = 1000
 CUTOFF_FREQ = 5
+FILTER_ORDER = 5
 RADIUS = 0.015
+GRAVITY = 9.8
+
+# converts flywheel frequency to linear velocity of the rope
+VELOCITY_FACTOR = 2 * np.pi * RADIUS
+
+# initial number of samples the raw buffers can hold, doubles when full
+BUFFER_SIZE = 1 << 16
+# initial number of bars the bar buffer can hold, doubles when full
+BAR_BUFFER_SIZE = 128
 
 log = logging.getLogger(__name__)
 
-DataSet = namedtuple('DataSet', ['x', 'y'])
+# the lowpass filter is fixed, so it only needs to be designed once
+LOWPASS_SOS = butter(FILTER_ORDER, CUTOFF_FREQ, btype='lowpass', output='sos', fs=SAMPLING_FREQ)
+# the same sections as plain floats for filtering one sample at a time
+LOWPASS_SECTIONS = LOWPASS_SOS.tolist()
+
 RunData = namedtuple("RunData", [
     "v_con_max", "v_ecc_max", "v_con_mean", "v_ecc_mean",
     "f_con_max", "f_ecc_max", "f_con_mean", "f_ecc_mean",
     "p_con_max", "p_ecc_max", "p_con_mean", "p_ecc_mean",
 ])
+# number of decimals the reported run statistics are rounded to
+RUN_DATA_DECIMALS = RunData(
+    v_con_max=2, v_ecc_max=2, v_con_mean=2, v_ecc_mean=2,
+    f_con_max=0, f_ecc_max=0, f_con_mean=0, f_ecc_mean=0,
+    p_con_max=0, p_ecc_max=0, p_con_mean=0, p_ecc_mean=0,
+)
 
 
-def derivative_gradient(data: DataSet) -> DataSet:
-    """Calculate the numerical gradient."""
-    x = np.array(data.x)
-    y = np.array(data.y)
-    return DataSet(x=x, y=np.gradient(y, x))
+def force_factors(conf: RunConf) -> Tuple[float, float]:
+    """Scale factors of the rate of frequency change and of the weight to force."""
+    # converts the rate of frequency change to force through angular acceleration
+    return 2 * np.pi * conf.load / RADIUS, conf.weight * GRAVITY
 
 
-def interpolation(data: DataSet) -> DataSet:
+def derivative_uniform(y: np.ndarray, fs: float = SAMPLING_FREQ,
+                       out: Optional[np.ndarray] = None) -> np.ndarray:
+    """Calculate the numerical gradient of samples equally spaced with frequency fs."""
+    dy = np.empty_like(y) if out is None else out
+    np.subtract(y[2:], y[:-2], out=dy[1:-1])
+    dy[1:-1] *= fs / 2
+    dy[0] = (y[1] - y[0]) * fs
+    dy[-1] = (y[-1] - y[-2]) * fs
+    return dy
+
+
+def interpolation(xp: np.ndarray, yp: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
     """Interpolate data to get equal sized spacings between points."""
     space = 1 / SAMPLING_FREQ
-    xp = np.array(data.x)
-    yp = np.array(data.y)
     x = np.arange(xp[0], xp[-1] + space, space)
     y = np.interp(x, xp, yp)
-    return DataSet(x=x, y=y)
+    return x, y
+
 
+def butter_lowpass_filter(y: np.ndarray) -> np.ndarray:
+    """Apply the zero-phase lowpass filter with CUTOFF_FREQ cutoff."""
+    return sosfiltfilt(LOWPASS_SOS, y)
 
-def butter_lowpass_filter(data: DataSet, cutoff: float) -> DataSet:
-    """Apply lowpass filter with cutoff frequency."""
-    x = np.array(data.x)
-    y = np.array(data.y)
-    b, a = butter(5, cutoff, btype='lowpass', output='ba', fs=SAMPLING_FREQ)
-    y = filtfilt(b, a, y)
-    return DataSet(x=x, y=y)
 
+def segment_argmax(values: np.ndarray, starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+    """Find the position of the first maximum in each [start, end) segment."""
+    lengths = ends - starts
+    offsets = np.cumsum(lengths) - lengths
+    # gather the segments next to each other so they can be reduced in a single call
+    positions = np.arange(lengths.sum()) + np.repeat(starts - offsets, lengths)
+    segments = values[positions]
+    maxes = np.maximum.reduceat(segments, offsets)
+    hits = np.flatnonzero(segments == np.repeat(maxes, lengths))
+    return positions[hits[np.searchsorted(hits, offsets)]]
 
-def find_second_peak(segment: np.ndarray) -> int:
+
+def segment_argmin(values: np.ndarray, starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+    """Find the position of the first minimum in each [start, end) segment."""
+    return segment_argmax(-values, starts, ends)
+
+
+def find_second_peak(segment: np.ndarray) -> float:
     """Find maximum with inequality on both sides or normal max."""
     global_max = segment.max()
-    potential_max = segment.max()
-    potential_maxes = sorted(argrelmax(segment, order=1)[0])
-    if potential_maxes:
-        potential_max = segment[potential_maxes[-1]]
-        if len(potential_maxes) > 1 and potential_max == global_max:
-            potential_max = segment[potential_maxes[-2]]
-        if potential_max / global_max < 0.9:
-            potential_max = global_max
+    # positions of strict local maxima, already in increasing order
+    inner = segment[1:-1]
+    peaks = np.flatnonzero((inner > segment[:-2]) & (inner > segment[2:])) + 1
+    if not len(peaks):
+        return global_max
+    potential_max = segment[peaks[-1]]
+    if len(peaks) > 1 and potential_max == global_max:
+        potential_max = segment[peaks[-2]]
+    if potential_max / global_max < 0.9:
+        return global_max
     return potential_max
 
 
+class ReportSignals(QObject):
+    """Signals of ReportTask, a QRunnable can't emit them itself."""
+    # end result and the number of the run it belongs to
+    finished = pyqtSignal(object, int)
+    failed = pyqtSignal()
+
+
+class ReportTask(QRunnable):
+    """Calculate the run statistics on a thread of the global thread pool.
+
+    It only uses its arguments, the results are saved to run_writer unless it is None.
+    """
+    def __init__(self, signals: ReportSignals, run_id: int, raw: np.ndarray, bar_time: np.ndarray,
+                 run_conf: RunConf, time: datetime, run_writer: Optional[DailyWorkbookWriter]):
+        super().__init__()
+        self.signals = signals
+        self.run_id = run_id
+        self.raw = raw
+        self.bar_time = bar_time
+        self.run_conf = run_conf
+        self.time = time
+        self.run_writer = run_writer
+
+    def run(self):
+        try:
+            run_data = Data.calc_stats(self.raw[:, 0], self.raw[:, 1], self.bar_time, self.run_conf)
+        except:
+            log.exception("Calculating run statistics failed!")
+            self.signals.failed.emit()
+            return
+
+        # the end result statistics are the mean over all repetitions
+        means = run_data.mean(axis=0)
+        end_result = RunData(*(round(m, d) for m, d in zip(means, RUN_DATA_DECIMALS)))
+        self.signals.finished.emit(end_result, self.run_id)
+
+        if self.run_writer is not None:
+            save_in_background(save_run_more, run_data, self.run_conf, self.time)
+            save_in_background(self.run_writer.append, end_result, self.run_conf, self.time)
+
+
 class Data:
     """Holding incoming data and processing utilities."""
     def __init__(self, master):
         self.master = master
-        self.raw_x = []
-        self.raw_y = []
-
-        self.bar_h = []
+        # raw samples are stored in preallocated buffers, only the first _n are valid
+        self._buf_x = np.empty(BUFFER_SIZE, dtype=np.float64)
+        self._buf_y = np.empty(BUFFER_SIZE, dtype=np.float64)
+        self._n = 0
+
+        # state of the causal lowpass filter used during the run, it runs
+        # on samples resampled to SAMPLING_FREQ starting at time _t0
+        self._zi = None  # type: Optional[List[List[float]]]
+        self._prev = (0., 0.)
+        self._t0 = 0.
+        self._ticks = 0
+        # last two outputs of the filter, the next power estimate is centered on the latter
+        self._recent_f = np.zeros(2, dtype=np.float64)
+
+        # bar heights are stored in a preallocated buffer, only the first _n_bars are valid
+        self._bar_h = np.zeros(BAR_BUFFER_SIZE, dtype=np.float64)
+        self._n_bars = 0
+        # changes whenever the bars do, so the graph can skip redrawing them
+        self.bars_version = 0
         self.new_bar_time = []
         self.descending_freq = False
         self.run_started = False
         self.run_conf = None  # type: Optional[RunConf]
         self.run_saved = False
+        # changes with every run, so a late report doesn't mark the next run as saved
+        self._run_id = 0
 
-    def set_run_conf(self, conf: RunConf):
-        self.run_conf = conf
+        # force scale factors of the current run configuration
+        self._k_force = 0.
+        self._weight_force = 0.
 
-    def add_new(self, point: tuple):
-        x, y = point
-        log.debug(f"point: {point}")
+        # statistics are calculated in the background, the report is shown in the gui thread
+        self.report_signals = ReportSignals()
+        self.report_signals.finished.connect(self._finish_report, Qt.QueuedConnection)
+        self.report_signals.failed.connect(self._report_failed, Qt.QueuedConnection)
 
-        if not self.run_started:
-            if y > MIN_FREQ_START:
-                log.debug(f"Run started!")
-                self.bar_h.append(0)
-                self.new_bar_time.append(0)
-                self.run_started = True
-            else:
-                log.debug(f"Waiting for y to raise! Currently, y={y:.3f}")
-                return
+    @property
+    def raw_x(self) -> np.ndarray:
+        """View of all the received sample times."""
+        return self._buf_x[:self._n]
 
-        self.raw_x.append(x)
-        self.raw_y.append(y)
+    @property
+    def raw_y(self) -> np.ndarray:
+        """View of all the received sample frequencies."""
+        return self._buf_y[:self._n]
 
-        if not self.descending_freq and y < 0.9:
-            self.descending_freq = True
-            log.debug(f"t={x} self.descending_freq = True")
+    def set_run_conf(self, conf: RunConf):
+        self.run_conf = conf
+        self._k_force, self._weight_force = force_factors(conf)
+
+    def _extend(self, points: np.ndarray):
+        """Store raw samples, doubling the buffers when they are full."""
+        n = self._n + len(points)
+        if n > len(self._buf_x):
+            size = len(self._buf_x)
+            while size < n:
+                size *= 2
+            self._buf_x = np.resize(self._buf_x, size)
+            self._buf_y = np.resize(self._buf_y, size)
+            log.debug(f"Raw buffers resized to {size}.")
+        self._buf_x[self._n:n] = points[:, 0]
+        self._buf_y[self._n:n] = points[:, 1]
+        self._n = n
+
+    def _new_bar(self, x: float):
+        """Start a new bar at time x, doubling the bar buffer when it is full."""
+        if self._n_bars == len(self._bar_h):
+            self._bar_h = np.resize(self._bar_h, 2 * len(self._bar_h))
+        self._bar_h[self._n_bars] = 0
+        self._n_bars += 1
+        self.bars_version += 1
+        self.new_bar_time.append(x)
+
+    def _filter_new(self, x: np.ndarray, y: np.ndarray) -> np.ndarray:
+        """Resample up to the last new sample and pass it through the causal lowpass filter.
+
+        Returns the filter output for all the grid points that were passed.
+        """
+        if self._zi is None:
+            # start the filter in the steady state of the first sample
+            self._zi = (sosfilt_zi(LOWPASS_SOS) * y[0]).tolist()
+            self._recent_f[:] = y[0]
+            self._prev = (x[0], y[0])
+            self._t0 = x[0]
+
+        # grid points that were not filtered yet, up to the last new sample
+        ticks = np.arange(self._ticks, int((x[-1] - self._t0) * SAMPLING_FREQ) + 2)
+        t = self._t0 + ticks / SAMPLING_FREQ
+        t = t[t <= x[-1]]
+
+        # linearly interpolate them from the previous and the new samples
+        prev_x, prev_y = self._prev
+        self._prev = (x[-1], y[-1])
+        if not len(t):
+            return t
+        y_t = np.interp(t, np.append(prev_x, x), np.append(prev_y, y))
+        self._ticks += len(t)
+        return np.array([self._lowpass_step(v) for v in y_t.tolist()])
+
+    def _lowpass_step(self, y: float) -> float:
+        """Advance the causal lowpass filter by one sample.
+
+        This is what sosfilt does (transposed direct form II sections), without
+        the overhead of calling into scipy for the few samples of a batch.
+        """
+        for (b0, b1, b2, _, a1, a2), z in zip(LOWPASS_SECTIONS, self._zi):
+            out = b0 * y + z[0]
+            z[0] = b1 * y - a1 * out + z[1]
+            z[1] = b2 * y - a2 * out
+            y = out
+        return y
 
-        if self.descending_freq and y > 1:
-            self.bar_h.append(0)
-            self.new_bar_time.append(x)
-            self.descending_freq = False
-            log.debug(f"t={x} self.descending_freq = False")
+    def _find_new_bars(self, x: np.ndarray, y: np.ndarray) -> np.ndarray:
+        """Start a new bar wherever the frequency raises again after descending.
 
-        power = self.calc_recent_power()
-        self.bar_h[-1] = max(self.bar_h[-1], power)
-        log.debug(f"Bar values {self.bar_h}")
+        Returns the times of the new bars.
+        """
+        # mark samples which start descending with 1 and which end it with 2,
+        # in between the thresholds the previous state is kept
+        state = np.zeros(len(y) + 1, dtype=np.int8)
+        state[0] = 1 if self.descending_freq else 2
+        state[1:][y < 0.9] = 1
+        state[1:][y > 1] = 2
+        state = state[np.maximum.accumulate(np.where(state, np.arange(len(state)), 0))]
+
+        for t in x[(state[:-1] == 2) & (state[1:] == 1)].tolist():
+            log.debug("t=%s self.descending_freq = True", t)
+        new_bars = x[(state[:-1] == 1) & (state[1:] == 2)]
+        for t in new_bars.tolist():
+            self._new_bar(t)
+            log.debug("t=%s self.descending_freq = False", t)
+        self.descending_freq = bool(state[-1] == 1)
+        return new_bars
+
+    def add_new_batch(self, points: np.ndarray):
+        """Add a batch of (time, frequency) samples, one sample per row."""
+        if not self.run_started:
+            started = np.flatnonzero(points[:, 1] > MIN_FREQ_START)
+            if not len(started):
+                log.debug("Waiting for y to raise! Currently, y=%.3f", points[-1, 1])
+                return
+            log.debug(f"Run started!")
+            self._new_bar(0)
+            self.run_started = True
+            points = points[started[0]:]
+
+        self._extend(points)
+        # the whole batch is processed at once, bars started in it follow the current one
+        x, y = points[:, 0], points[:, 1]
+        bar = self._n_bars - 1
+        bar_times = self._find_new_bars(x, y)
+        filtered = self._filter_new(x, y)
+        if not len(filtered):
+            return
 
-    def calc_recent_power(self) -> float:
-        """Calculate power using recent samples."""
-        if len(self.raw_x) < SAMPLES_FOR_FILTER or (self.raw_x[-1] - self.raw_x[0]) < 0.2:
-            return 0
+        frequency = np.concatenate((self._recent_f, filtered))
+        self._recent_f = frequency[-2:]
+        power = self.calc_recent_power(frequency)
+
+        # number of filtered samples up to each new one, the power is centered on the one before it
+        count = np.arange(self._ticks - len(filtered) + 1, self._ticks + 1)
+        # wait for the filter to settle
+        settled = count >= SETTLE_TIME * SAMPLING_FREQ
+        centers = self._t0 + (count[settled] - 2) / SAMPLING_FREQ
+        # bars show the max power of the estimates after their start
+        bars = bar + np.searchsorted(bar_times, centers, side='right')
+        before = self._bar_h[bar:self._n_bars].copy()
+        np.maximum.at(self._bar_h, bars, power[settled])
+        if not np.array_equal(before, self._bar_h[bar:self._n_bars]):
+            self.bars_version += 1
+
+    def calc_recent_power(self, frequency: np.ndarray) -> np.ndarray:
+        """Calculate power from consecutive outputs of the causal filter, except the first and last."""
+        # central difference around each of the inner samples
+        linear_velocity = frequency[1:-1] * VELOCITY_FACTOR
+        force = frequency[2:] - frequency[:-2]
+        force *= SAMPLING_FREQ / 2 * self._k_force
+        np.abs(force, out=force)
+        force += self._weight_force
+
+        return force * linear_velocity
 
-        inter_data = interpolation(DataSet(x=self.raw_x[-SAMPLES_FOR_FILTER:],
-                                           y=self.raw_y[-SAMPLES_FOR_FILTER:]))
-        try:
-            filtered_data = butter_lowpass_filter(inter_data, cutoff=CUTOFF_FREQ)
-        except Exception:
-            self.master._close_connection()
-            QMessageBox.warning(self.master, "Unrecoverable failure!",
-                                "The program encounter and invalid measurement.")
-            exit()
+    @staticmethod
+    def calc_stats(raw_x: np.ndarray, raw_y: np.ndarray, bar_time: np.ndarray, run_conf: RunConf) -> np.ndarray:
+        """Calculate all the stats for the run samples, times of its new bars and its configuration.
 
-        frequency = filtered_data.y
-        angular_velocity = frequency * 2 * np.pi
-        linear_velocity = angular_velocity * RADIUS
+        Returns an array with a row for each repetition and columns in RunData order.
+        """
+        # interpolate points as they are not equally spaced
+        time, frequency = interpolation(raw_x, raw_y)
+        frequency = butter_lowpass_filter(frequency)
 
-        angular_acceleration = derivative_gradient(DataSet(x=filtered_data.x,
-                                                           y=angular_velocity)).y
+        # calculate all the statistics, involves heavy physics
+        # the arrays are long, so they are rows of one array that can be reduced together
+        # and are computed in place instead of allocating temporaries
+        signals = np.empty((3, len(frequency)), dtype=np.float64)
+        linear_velocity, force, power = signals
+        np.multiply(frequency, VELOCITY_FACTOR, out=linear_velocity)
+        # interpolated samples are equally spaced, the rate of frequency change is turned into force
+        derivative_uniform(frequency, out=force)
+        k_force, weight_force = force_factors(run_conf)
+        force *= k_force
+        np.abs(force, out=force)
+        force += weight_force
+        np.multiply(force, linear_velocity, out=power)
+
+        # transform time of new bar to the closest position, time is sorted so use binary search
+        new_bar_pos = np.clip(np.searchsorted(time, bar_time), 1, len(time) - 1)
+        new_bar_pos[bar_time - time[new_bar_pos - 1] <= time[new_bar_pos] - bar_time] -= 1
+        new_bar_pos = np.append(new_bar_pos, len(time) - 1)
+
+        # in segments find min to exactly cut segments, only look at the second half
+        middles = new_bar_pos[:-1] + (new_bar_pos[1:] - new_bar_pos[:-1]) // 2
+        exact_new_segment = np.append(0, segment_argmin(frequency, middles, new_bar_pos[1:]))
 
-        force = np.abs(angular_acceleration * (self.run_conf.load / RADIUS))
-        force = force + (self.run_conf.weight * 9.8)
+        # remove first START_RUNS and more than COUNTED_RUNS
+        cuts = exact_new_segment[START_RUNS:START_RUNS + COUNTED_RUNS + 1]
+        log.info(f"number of segments: {len(cuts) - 1}, cut x: {time[cuts]}")
 
-        power = force * linear_velocity
-        # take middle value to negate side effect of processing appearing on edges
-        return power[len(power) // 2]
+        # split each repetition on the frequency peak into concentric and eccentric part
+        starts, ends = cuts[:-1], cuts[1:]
+        peaks = segment_argmax(frequency, starts, ends)
+        bounds = np.column_stack([starts, peaks]).ravel()
+        lengths = np.diff(np.append(bounds, ends[-1]))
 
-    def calc_stats(self) -> List[RunData]:
-        """Calculate all the stats for the current run."""
-        raw_dataset = DataSet(x=self.raw_x, y=self.raw_y)
+        # reduce all the parts at once, even positions are concentric and odd eccentric
+        end = ends[-1]
+        v_max = np.array([find_second_peak(linear_velocity[i:j])
+                          for i, j in zip(bounds, np.append(bounds[1:], end))])
+        v_mean, f_mean, p_mean = np.add.reduceat(signals[:, :end], bounds, axis=1) / lengths
+        f_max, p_max = np.maximum.reduceat(signals[1:, :end], bounds, axis=1)
 
-        # interpolate points as they are not equally spaced
-        filtered_data = butter_lowpass_filter(
-            interpolation(raw_dataset),
-            cutoff=CUTOFF_FREQ
-        )
+        # one row per repetition, each statistic gives a concentric and an eccentric column
+        stats = np.empty((len(starts), len(RunData._fields)), dtype=np.float64)
+        for k, part_stat in enumerate((v_max, v_mean, f_max, f_mean, p_max, p_mean)):
+            stats[:, 2 * k:2 * k + 2] = part_stat.reshape(-1, 2)
 
-        # calculate all the statistics, involves heavy physics
-        frequency = filtered_data.y
-        angular_velocity = frequency * 2 * np.pi
-        linear_velocity = angular_velocity * RADIUS
-        angular_acceleration = derivative_gradient(DataSet(x=filtered_data.x,
-                                                           y=angular_velocity)).y
-        force = np.abs(angular_acceleration * (self.run_conf.load / RADIUS))
-        force = force + (self.run_conf.weight * 9.8)
-        power = force * linear_velocity
-
-        # transform time of new bar to the closest position
-        new_bar_pos = [np.abs(filtered_data.x - new_pos).argmin() for new_pos in self.new_bar_time]
-        new_bar_pos.append(len(filtered_data.x) - 1)
-
-        # in segments find min to exactly cut segments
-        exact_new_segment = [0]
-        for i, j in zip(new_bar_pos[:-1], new_bar_pos[1:]):
-            # only look at the second half
-            middle = i + int((j - i) / 2)
-            s_min = filtered_data.y[middle:j].argmin()
-            exact_new_segment.append(middle + s_min)
+        return stats
 
-        # remove first START_RUNS and more than COUNTED_RUNS
-        exact_new_segment = exact_new_segment[START_RUNS:START_RUNS + COUNTED_RUNS + 1]
-        log.info(f"number of segments: {len(exact_new_segment) - 1}, cut x: {filtered_data.x[exact_new_segment]}")
-
-        results = []
-        for i, j in zip(exact_new_segment[:-1], exact_new_segment[1:]):
-            # calculate all statistics for each repetition
-            m = filtered_data.y[i:j].argmax() + i
-            results.append(RunData(
-                v_con_max=find_second_peak(linear_velocity[i:m]),
-                v_ecc_max=find_second_peak(linear_velocity[m:j]),
-                v_con_mean=linear_velocity[i:m].mean(),
-                v_ecc_mean=linear_velocity[m:j].mean(),
-                f_con_max=force[i:m].max(),
-                f_ecc_max=force[m:j].max(),
-                f_con_mean=force[i:m].mean(),
-                f_ecc_mean=force[m:j].mean(),
-                p_con_max=power[i:m].max(),
-                p_ecc_max=power[m:j].max(),
-                p_con_mean=power[i:m].mean(),
-                p_ecc_mean=power[m:j].mean(),
-            ))
-
-        return results
-
-    def get_bar_data(self) -> list:
-        return self.bar_h
+    def get_bar_data(self) -> np.ndarray:
+        return self._bar_h[:self._n_bars]
 
     def report(self):
-        if len(self.bar_h) < START_RUNS + 1:
+        if self._n_bars < START_RUNS + 1:
             QMessageBox.warning(self.master, "Invalid measurement!",
                                 "Measurement must have at least 1 valid repetition!\n"
                                 "Metrics could not be calculated!")
             return
-        elif len(self.bar_h) < START_RUNS + COUNTED_RUNS + 1:
+        elif self._n_bars < START_RUNS + COUNTED_RUNS + 1:
             QMessageBox.warning(self.master, "Insufficient measurement!",
                                 f"To ensure measurements accuracy {START_RUNS + COUNTED_RUNS + 1} repetitions are advised!\n"
                                 "Calculated metrics may be inaccurate!")
 
         # save data
         current_data_time = datetime.now()
-        # save raw measurements for potential analysis
-        save_data(self, self.run_conf, current_data_time)
-        run_data = self.calc_stats()
-
-        # the end result statistics are the mean over all repetitions
-        end_result = RunData(
-            v_con_max=round(np.mean([r.v_con_max for r in run_data]), 2),
-            v_ecc_max=round(np.mean([r.v_ecc_max for r in run_data]), 2),
-            v_con_mean=round(np.mean([r.v_con_mean for r in run_data]), 2),
-            v_ecc_mean=round(np.mean([r.v_ecc_mean for r in run_data]), 2),
-            f_con_max=round(np.mean([r.f_con_max for r in run_data]), 0),
-            f_ecc_max=round(np.mean([r.f_ecc_max for r in run_data]), 0),
-            f_con_mean=round(np.mean([r.f_con_mean for r in run_data]), 0),
-            f_ecc_mean=round(np.mean([r.f_ecc_mean for r in run_data]), 0),
-            p_con_max=round(np.mean([r.p_con_max for r in run_data]), 0),
-            p_ecc_max=round(np.mean([r.p_ecc_max for r in run_data]), 0),
-            p_con_mean=round(np.mean([r.p_con_mean for r in run_data]), 0),
-            p_ecc_mean=round(np.mean([r.p_ecc_mean for r in run_data]), 0),
-        )
-
-        if not self.run_saved:
-            save_run_more(run_data, self.run_conf, current_data_time)
-            save_run(end_result, self.run_conf, current_data_time)
+        # save raw measurements for potential analysis, saving and calculating happen in the
+        # background so they get a copy of the buffers which are reused by the next run
+        raw = np.column_stack([self.raw_x, self.raw_y])
+        save_in_background(save_data, raw, self.run_conf, current_data_time)
+
+        # the report is shown once the statistics are calculated
+        run_writer = None if self.run_saved else self.master.run_writer
+        QThreadPool.globalInstance().start(ReportTask(
+            self.report_signals, self._run_id, raw, np.array(self.new_bar_time),
+            self.run_conf, current_data_time, run_writer))
+
+    def _finish_report(self, run_data: RunData, run_id: int):
+        if run_id == self._run_id:
             self.run_saved = True
+        self.show_report(run_data)
 
-        self.show_report(end_result)
+    def _report_failed(self):
+        QMessageBox.warning(self.master, "Report failed!",
+                            "Metrics could not be calculated!\n"
+                            "Try repeating the measurement.")
 
     @staticmethod
     def show_report(run_data: RunData):
@@ -304,14 +494,20 @@ class Data:
         report_dialog.exec_()
 
     def clear(self):
-        self.raw_x = []
-        self.raw_y = []
+        self._n = 0
+
+        self._zi = None
+        self._prev = (0., 0.)
+        self._t0 = 0.
+        self._ticks = 0
 
-        self.bar_h = []
+        self._n_bars = 0
+        self.bars_version += 1
         self.new_bar_time = []
         self.descending_freq = False
         self.run_started = False
         self.run_saved = False
+        self._run_id += 1
         log.info("Data cleared.")
 
 
@@ -1,14 +1,16 @@
 import logging
 from collections import namedtuple
-from typing import Optional
+from functools import lru_cache
+from typing import Optional, Tuple
 
-from PyQt5.QtCore import QSettings, Qt
+from PyQt5.QtCore import Qt
 from PyQt5.QtGui import QDoubleValidator, QIntValidator
 from PyQt5.QtWidgets import (QCheckBox, QComboBox, QDialog, QDialogButtonBox,
                              QFrame, QGridLayout, QLabel, QLineEdit,
                              QPushButton, QVBoxLayout)
 
-from smartinertia.connection import get_ports
+from smartinertia.connection import get_cached_ports, get_ports
+from smartinertia.settings import SettingsCache
 
 LOADS = ["0.025", "0.05", "0.075", "0.1",
          "0.125", "0.15", "0.175", "0.2",
@@ -20,6 +22,12 @@ RunConf = namedtuple('RunConf', ["name", "weight", "load", "pulley", "target_che
 ConnConf = namedtuple('ConnConf', ['port'])
 
 
+@lru_cache(maxsize=None)
+def run_validators() -> Tuple[QDoubleValidator, QIntValidator]:
+    """Weight and target validators shared by all run dialogs, created once a QApplication exists."""
+    return QDoubleValidator(0., 500., 1), QIntValidator(0, 10_000)
+
+
 class QHLine(QFrame):
     def __init__(self):
         super(QHLine, self).__init__()
@@ -30,31 +38,33 @@ class QHLine(QFrame):
 class RunDialog(QDialog):
     """Configure run state."""
     def __init__(self, master):
-        super().__init__()
+        # opened without exec_, the parent is needed for the dialog to be modal
+        super().__init__(master)
         self.setWindowTitle("Run")
-        self.m_settings = master.settings  # type: QSettings
+        self.m_settings = master.settings  # type: SettingsCache
         self.run_conf = None  # type: Optional[RunConf]
+        weight_validator, target_validator = run_validators()
 
         self.name_label = QLineEdit()
-        self.name_label.setText(self.m_settings.value('run/name', type=str))
+        self.name_label.setText(self.m_settings.get('run/name', str))
 
         self.weight_label = QLineEdit()
-        self.weight_label.setValidator(QDoubleValidator(0., 500., 1))
-        self.weight_label.setText(self.m_settings.value('run/weight', type=str))
+        self.weight_label.setValidator(weight_validator)
+        self.weight_label.setText(self.m_settings.get('run/weight', str))
 
         self.load_combo_box = QComboBox()
         self.load_combo_box.addItems(LOADS)
-        self.load_combo_box.setCurrentText(self.m_settings.value('run/load', type=str))
+        self.load_combo_box.setCurrentText(self.m_settings.get('run/load', str))
 
         self.pulley_checkbox = QCheckBox()
-        self.pulley_checkbox.setChecked(self.m_settings.value('run/pulley', type=bool))
+        self.pulley_checkbox.setChecked(self.m_settings.get('run/pulley', bool))
 
         self.target_edit = QLineEdit()
-        self.target_edit.setValidator(QIntValidator(0, 10_000))
-        self.target_edit.setText(self.m_settings.value('run/target_value', type=str))
+        self.target_edit.setValidator(target_validator)
+        self.target_edit.setText(self.m_settings.get('run/target_value', str))
 
         self.target_checkbox = QCheckBox()
-        self.target_checkbox.setChecked(self.m_settings.value('run/target_check', type=bool))
+        self.target_checkbox.setChecked(self.m_settings.get('run/target_check', bool))
         self.target_checkbox.stateChanged.connect(self._hide_target)
 
         grid = QGridLayout()
@@ -116,13 +126,12 @@ class RunDialog(QDialog):
             target_value=target,
         )
         log.info(f"Run configuration: {self.run_conf}.")
-        self.m_settings.setValue('run/name', self.run_conf.name)
-        self.m_settings.setValue('run/weight', self.run_conf.weight)
-        self.m_settings.setValue('run/load', self.run_conf.load)
-        self.m_settings.setValue('run/pulley', self.run_conf.pulley)
-        self.m_settings.setValue('run/target_check', self.run_conf.target_check)
-        self.m_settings.setValue('run/target_value', self.run_conf.target_value)
-        self.m_settings.sync()
+        self.m_settings.set('run/name', self.run_conf.name)
+        self.m_settings.set('run/weight', self.run_conf.weight)
+        self.m_settings.set('run/load', self.run_conf.load)
+        self.m_settings.set('run/pulley', self.run_conf.pulley)
+        self.m_settings.set('run/target_check', self.run_conf.target_check)
+        self.m_settings.set('run/target_value', self.run_conf.target_value)
         self.close()
 
 
@@ -131,14 +140,14 @@ class ConnectionDialog(QDialog):
     def __init__(self, master):
         super().__init__()
         self.setWindowTitle("Connection")
-        self.m_settings = master.settings  # type: QSettings
+        self.m_settings = master.settings  # type: SettingsCache
         self.conn_conf = None  # type: Optional[ConnConf]
 
-        current_ports = get_ports()
+        current_ports = get_cached_ports()
         self.port_comboBox = QComboBox()
         self.port_comboBox.addItems(current_ports)
 
-        saved_port = self.m_settings.value('connection/port', type=str)
+        saved_port = self.m_settings.get('connection/port', str)
         if saved_port in current_ports:
             self.port_comboBox.setCurrentText(saved_port)
 
@@ -168,8 +177,7 @@ class ConnectionDialog(QDialog):
         log.info("Connection dialog accepted.")
         self.conn_conf = ConnConf(port=self.port_comboBox.currentText())
         log.info(f"Port {self.conn_conf.port} was selected.")
-        self.m_settings.setValue('connection/port', self.conn_conf.port)
-        self.m_settings.sync()
+        self.m_settings.set('connection/port', self.conn_conf.port)
         self.close()
 
 
@@ -178,8 +186,12 @@ class ReportDialog(QDialog):
     def __init__(self, report):
         super().__init__()
         self.setWindowTitle("Report")
+        # the report is always html, so QLabel doesn't have to guess the format
+        report_label = QLabel()
+        report_label.setTextFormat(Qt.RichText)
+        report_label.setText(report)
         main_layout = QVBoxLayout()
-        main_layout.addWidget(QLabel(report))
+        main_layout.addWidget(report_label)
         self.setLayout(main_layout)
         self.setFixedSize(self.sizeHint())
         log.info("Opened report dialog.")
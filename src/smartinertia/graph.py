@@ -1,9 +1,9 @@
 import logging
-from typing import Optional
+from typing import Optional, Tuple
 
 import numpy as np
 import pyqtgraph as pg
-from PyQt5.QtCore import QRectF, Qt
+from PyQt5.QtCore import QRectF, Qt, pyqtSlot
 
 from smartinertia.data import COUNTED_RUNS, START_RUNS
 
@@ -15,11 +15,23 @@ orange_brush = pg.mkBrush(pg.mkColor(255, 77, 6))
 MAX_H = 525
 MAX_X = START_RUNS + COUNTED_RUNS + 1
 
+# bar brushes are picked from the palette by the bar color indices, counted repetitions are orange
+PALETTE = np.array([gray_brush, orange_brush], dtype=object)
+BAR_COLORS = np.zeros(MAX_X, dtype=np.uint8)
+BAR_COLORS[START_RUNS:COUNTED_RUNS + START_RUNS] = 1
+
 
 class BarPlotWidget(pg.PlotWidget):
     def __init__(self, data):
         super().__init__()
         self.max_h = MAX_H
+        # bar positions and colors are reused between redraws, they only grow with extra bars
+        self._x = np.arange(1, MAX_X + 1)
+        self._brushes = PALETTE[BAR_COLORS]
+        # version of the last drawn bars, nothing is redrawn while it stays the same
+        self._last_version = None  # type: Optional[int]
+        # last (max_x, max_h) the view range was set to
+        self._range = None  # type: Optional[Tuple[float, float]]
         self._init_plot()
         self.data = data
         self.target_line = None  # type: Optional[pg.InfiniteLine]
@@ -34,7 +46,7 @@ class BarPlotWidget(pg.PlotWidget):
         self.setMouseEnabled(False, False)  # disable moving plot with mouse
         self.setMenuEnabled(False)  # disable right click menu
         self.hideButtons()  # hide "A" button in bottom left corner
-        self.setRange(QRectF(0.4, 0, MAX_X + 0.2, self.max_h), padding=0)
+        self._set_range(MAX_X + 0.2, self.max_h)
 
     def add_target_line(self, target):
         """Add a target line to the specified value."""
@@ -48,26 +60,47 @@ class BarPlotWidget(pg.PlotWidget):
         current_rect.setHeight(current_rect.height() * 1.3)
         self.max_h = current_rect.height()
         self.setRange(current_rect)
+        self._range = None
 
+    @pyqtSlot()
     def update_graph(self):
         """Get updated bar plot data and redraw the bars."""
+        if self.data.bars_version == self._last_version:
+            return
         h = self.data.get_bar_data()
-        if not h:
+        if not len(h):
             return
+        self._last_version = self.data.bars_version
+
+        n = len(h)
+        if n > len(self._x):
+            self._grow_bars(n)
+        self.bar_plot.setOpts(x=self._x[:n], height=h, brushes=self._brushes[:n])
 
-        x = list(range(1, len(h) + 1))
-        brushes = np.array([gray_brush for _ in range(len(h))])
-        brushes[START_RUNS:COUNTED_RUNS + START_RUNS] = orange_brush
-        self.bar_plot.setOpts(x=x, height=h, brushes=brushes)
+        self.max_h = max(h.max() * 1.05, self.max_h)
+        max_x = max(n, MAX_X) + 0.2
+        self._set_range(max_x, self.max_h)
+
+    def _set_range(self, max_x: float, max_h: float):
+        """Set the view range, skipped if it is already set to it."""
+        if self._range == (max_x, max_h):
+            return
+        self._range = (max_x, max_h)
+        self.setRange(QRectF(0.4, 0, max_x, max_h), padding=0)
 
-        self.max_h = max(max(h) * 1.05, self.max_h)
-        max_x = max(max(x), MAX_X) + 0.2
-        self.setRange(QRectF(0.4, 0, max_x, self.max_h), padding=0)
+    def _grow_bars(self, n: int):
+        """Make room for at least n bars, the extra ones are gray."""
+        size = max(2 * len(self._x), n)
+        self._x = np.arange(1, size + 1)
+        colors = np.zeros(size, dtype=np.uint8)
+        colors[:MAX_X] = BAR_COLORS
+        self._brushes = PALETTE[colors]
 
     def clear_graph(self):
         self.bar_plot.setOpts(x=[], height=[], brushes=[])
+        self._last_version = None
         self.max_h = MAX_H
-        self.setRange(QRectF(0.4, 0, MAX_X + 0.2, self.max_h), padding=0)
+        self._set_range(MAX_X + 0.2, self.max_h)
         if self.target_line is not None:
             self.plotItem.vb.removeItem(self.target_line)
             self.target_line = None
@@ -1,11 +1,14 @@
+import csv
 import logging
 import os
-from datetime import datetime
-from typing import List
+import threading
+from datetime import date, datetime
+from functools import lru_cache
+from typing import Callable, List, Optional, Set, Tuple
 
 import numpy as np
 from openpyxl import Workbook, load_workbook
-from PyQt5.QtCore import QStandardPaths
+from PyQt5.QtCore import QRunnable, QStandardPaths, QThreadPool
 
 from smartinertia.dialogs import RunConf
 
@@ -18,75 +21,160 @@ HEADER = [
     "Force Con Max", "Force Ecc Max", "Force Con Mean", "Force Ecc Mean",
     "Power Con Max", "Power Ecc Max", "Power Con Mean", "Power Ecc Mean"
 ]
+# characters of iso datetime which are not allowed in Windows file names
+ISO2WIN_TABLE = str.maketrans({":": "-"})
+# save directories known to exist
+ENSURED_DIRS = set()  # type: Set[str]
+
+
+class SaveTask(QRunnable):
+    """Run a save function on a thread of the global thread pool."""
+    def __init__(self, save: Callable, *args):
+        super().__init__()
+        self.save = save
+        self.args = args
+
+    def run(self):
+        try:
+            self.save(*self.args)
+        except:
+            log.exception("Saving in background failed!")
+
+
+def save_in_background(save: Callable, *args):
+    """Save without blocking the gui, the arguments must not change afterwards."""
+    QThreadPool.globalInstance().start(SaveTask(save, *args))
 
 
 def iso2win(iso_timee: str) -> str:
     """Fix datetime in iso formated string to be used in Windows file names."""
-    return iso_timee.replace(":", "-").split(".")[0]
+    return iso_timee.translate(ISO2WIN_TABLE).partition(".")[0]
 
 
-def save_run(run_data: 'RunData', run_conf: RunConf, current_data_time: datetime):
-    """Save the results of this run into a file."""
-    save_dir = os.path.join(DOCUMENTS_PATH, "SmartInertia")
-    save_file = os.path.join(save_dir,
-                             f"measurements_{current_data_time.strftime('%Y-%m-%d')}.xlsx")
-    new_row = [
-        current_data_time.isoformat(), run_conf.name, run_conf.weight, run_conf.load, run_conf.pulley,
-        run_data.v_con_max, run_data.v_ecc_max, run_data.v_con_mean, run_data.v_ecc_mean,
-        run_data.f_con_max, run_data.f_ecc_max, run_data.f_con_mean, run_data.f_ecc_mean,
-        run_data.p_con_max, run_data.p_ecc_max, run_data.p_con_mean, run_data.p_ecc_mean,
-    ]
-
-    if os.path.exists(save_file):
+@lru_cache(maxsize=4)
+def day_dir(day: date) -> str:
+    """Directory for the files of the individual runs of the day."""
+    return os.path.join(DOCUMENTS_PATH, "SmartInertia", f"measurements_{day.strftime('%Y-%m-%d')}")
+
+
+@lru_cache(maxsize=4)
+def day_files(day: date) -> Tuple[str, str]:
+    """Paths of the measurements file of the day and of its csv."""
+    save_file = os.path.join(DOCUMENTS_PATH, "SmartInertia", f"measurements_{day.strftime('%Y-%m-%d')}.xlsx")
+    return save_file, os.path.splitext(save_file)[0] + ".csv"
+
+
+def ensure_dir(save_dir: str):
+    """Create the save directory, only the first call for each directory touches the disk."""
+    if save_dir in ENSURED_DIRS:
+        return
+    try:
+        os.makedirs(save_dir, exist_ok=True)
+        ENSURED_DIRS.add(save_dir)
+    except:
+        log.exception("Couldn't create save directory!")
+
+
+def row_prefix(run_conf: RunConf, current_data_time: datetime) -> List:
+    """Leading columns of a result row, they describe the run."""
+    return [current_data_time.isoformat(), run_conf.name, run_conf.weight, run_conf.load, run_conf.pulley]
+
+
+def cell_float(value: str) -> Optional[float]:
+    """Convert a csv cell to float, empty cells stay empty."""
+    return float(value) if value else None
+
+
+def export_xlsx_from_csv(csv_file: str, save_file: str):
+    """Export the run results stored in csv_file to the xlsx save_file."""
+    wb = Workbook(write_only=True)
+    sheet = wb.create_sheet()
+    with open(csv_file, newline="", encoding="utf-8") as f:
+        reader = csv.reader(f)
+        sheet.append(next(reader))
+        for row in reader:
+            # blank rows can come from the workbook the csv was started from
+            if not any(row):
+                continue
+            time, name, weight, load, pulley, *stats = row
+            sheet.append([time, name, cell_float(weight), cell_float(load),
+                          pulley == "True" if pulley else None, *map(cell_float, stats)])
+    wb.save(filename=save_file)
+
+
+class DailyWorkbookWriter:
+    """Collect the results of all runs of a day in its measurements file.
+
+    Each run is appended to a csv file of the day and the xlsx is exported
+    from it, so the workbook is only written and not parsed after every run.
+    The csv gets the modification time of the exported xlsx, a newer xlsx
+    was edited by the user and the csv is started again from it.
+    """
+    def __init__(self):
+        # runs are saved from the thread pool, only one may use the files at a time
+        self._lock = threading.Lock()
+
+    def append(self, run_data: 'RunData', run_conf: RunConf, current_data_time: datetime):
+        """Save the results of this run."""
+        with self._lock:
+            self._append(run_data, run_conf, current_data_time)
+
+    def _append(self, run_data: 'RunData', run_conf: RunConf, current_data_time: datetime):
+        save_file, csv_file = day_files(current_data_time.date())
+        # RunData fields are already in the column order
+        new_row = row_prefix(run_conf, current_data_time) + list(run_data)
+
+        ensure_dir(os.path.dirname(save_file))
+
         try:
-            wb = load_workbook(save_file)
-            wb.active.append(new_row)
-            wb.save(filename=save_file)
-            log.info(f"Run saved to existing {save_file}.")
+            rows = []
+            mode = "a"
+            if not os.path.exists(csv_file):
+                rows = [HEADER]
+            # start with the runs of an xlsx written before results were kept in csv or edited since
+            if os.path.exists(save_file) and (not os.path.exists(csv_file) or
+                                              os.path.getmtime(save_file) > os.path.getmtime(csv_file)):
+                old_wb = load_workbook(save_file, read_only=True)
+                rows = [list(row) for row in old_wb.active.iter_rows(values_only=True)
+                        if any(cell is not None for cell in row)]
+                old_wb.close()
+                mode = "w"
+            rows.append(new_row)
+            with open(csv_file, mode, newline="", encoding="utf-8") as f:
+                csv.writer(f).writerows(rows)
+            log.info(f"Run saved to {csv_file}.")
         except:
-            log.exception("Run couldn't be saved to existing file!")
-    else:
-        if not os.path.exists(save_dir):
-            try:
-                os.mkdir(save_dir)
-            except:
-                log.exception("Couldn't create save directory!")
-
-        wb = Workbook()
-        sheet = wb.active
-        sheet.append(HEADER)
-        sheet.append(new_row)
+            log.exception("Run couldn't be saved!")
+            return
+
         try:
-            wb.save(filename=save_file)
-            log.info(f"Run saved to new file {save_file}.")
+            export_xlsx_from_csv(csv_file, save_file)
+            # the csv holds the same runs as the xlsx now
+            save_mtime = os.stat(save_file).st_mtime_ns
+            os.utime(csv_file, ns=(save_mtime, save_mtime))
+            log.info(f"Runs exported to {save_file}.")
         except:
-            log.exception("Run couldn't be saved to new file!")
+            # the csv keeps the run, it is exported with the next one
+            log.exception("Runs couldn't be exported!")
 
 
-def save_run_more(run_datas: List['RunData'], run_conf: RunConf, current_data_time: datetime):
-    """Save the more results of this run into a file."""
+def save_run_more(run_datas: np.ndarray, run_conf: RunConf, current_data_time: datetime):
+    """Save the more results of this run into a file, run_datas has a row per repetition in RunData order."""
 
-    save_dir = os.path.join(DOCUMENTS_PATH, "SmartInertia", f"measurements_{current_data_time.strftime('%Y-%m-%d')}")
+    save_dir = day_dir(current_data_time.date())
     save_file = os.path.join(save_dir, f"{iso2win(current_data_time.isoformat())}_{run_conf.name}_{run_conf.load}.xlsx")
 
-    if not os.path.exists(save_dir):
-        try:
-            os.mkdir(save_dir)
-        except:
-            log.exception("Couldn't create save directory!")
+    ensure_dir(save_dir)
 
-    wb = Workbook()
-    sheet = wb.active
+    # the rows are only appended, so the cells don't need to be kept in memory
+    wb = Workbook(write_only=True)
+    sheet = wb.create_sheet()
     sheet.append(HEADER)
 
-    for rd in run_datas:
-        new_row = [
-            current_data_time.isoformat(), run_conf.name, run_conf.weight, run_conf.load, run_conf.pulley,
-            rd.v_con_max, rd.v_ecc_max, rd.v_con_mean, rd.v_ecc_mean,
-            rd.f_con_max, rd.f_ecc_max, rd.f_con_mean, rd.f_ecc_mean,
-            rd.p_con_max, rd.p_ecc_max, rd.p_con_mean, rd.p_ecc_mean,
-        ]
-        sheet.append(new_row)
+    # the run configuration is the same for all the repetitions
+    prefix = row_prefix(run_conf, current_data_time)
+    for rd in run_datas.tolist():
+        sheet.append(prefix + rd)
 
     try:
         wb.save(filename=save_file)
@@ -95,28 +183,18 @@ def save_run_more(run_datas: List['RunData'], run_conf: RunConf, current_data_ti
         log.exception("Run couldn't be saved to new file!")
 
 
-def save_data(data: 'Data', run_conf: RunConf, current_data_time: datetime):
-    """Save dataset to file."""
-    save_dir = os.path.join(DOCUMENTS_PATH, "SmartInertia",
-                            f"measurements_{current_data_time.strftime('%Y-%m-%d')}")
+def save_data(raw: np.ndarray, run_conf: RunConf, current_data_time: datetime):
+    """Save dataset to file, raw has a (time, frequency) row per sample."""
+    save_dir = day_dir(current_data_time.date())
     save_file = os.path.join(save_dir,
-                             f"{iso2win(current_data_time.isoformat())}_{run_conf.name}_{run_conf.load}_raw.xlsx")
-
-    if not os.path.exists(save_dir):
-        try:
-            os.mkdir(save_dir)
-        except:
-            log.exception("Couldn't create save directory!")
+                             f"{iso2win(current_data_time.isoformat())}_{run_conf.name}_{run_conf.load}_raw.csv")
 
-    wb = Workbook()
-    sheet = wb.active
-    sheet.append(["time", "frequency"])
-
-    for x, y in zip(data.raw_x, data.raw_y):
-        sheet.append([x, y])
+    ensure_dir(save_dir)
 
+    # raw traces are long, write them in one call instead of a row at a time
     try:
-        wb.save(filename=save_file)
+        np.savetxt(save_file, raw,
+                   fmt='%.6f', delimiter=',', header="time,frequency", comments='')
         log.info(f"Saved raw run to file.")
     except:
         log.exception("Cannot save run data!")
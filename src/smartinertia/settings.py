@@ -0,0 +1,41 @@
+import logging
+from typing import Any, Dict, Set
+
+from PyQt5.QtCore import QSettings
+
+log = logging.getLogger(__name__)
+
+
+class SettingsCache:
+    """Keep settings values in memory, so QSettings is only read once per key."""
+    def __init__(self, settings: QSettings):
+        self.settings = settings
+        self._cache = {}  # type: Dict[str, Any]
+        # keys whose values changed since the last flush
+        self._dirty = set()  # type: Set[str]
+
+    def get(self, key: str, type: type = str, default: Any = None) -> Any:
+        """Get the value of key converted to type."""
+        if key not in self._cache:
+            self._cache[key] = self.settings.value(key, default, type=type)
+        value = self._cache[key]
+        if not isinstance(value, type):
+            value = type(value)
+        return value
+
+    def set(self, key: str, value: Any):
+        """Set the value of key, it is written to QSettings on the next flush if it changed."""
+        if key in self._cache and self._cache[key] == value:
+            return
+        self._cache[key] = value
+        self._dirty.add(key)
+
+    def flush(self):
+        """Write the changed settings to permanent storage."""
+        if not self._dirty:
+            return
+        for key in self._dirty:
+            self.settings.setValue(key, self._cache[key])
+        self.settings.sync()
+        log.info(f"Settings flushed: {sorted(self._dirty)}.")
+        self._dirty.clear()
@@ -1,35 +1,64 @@
 import logging
-from typing import Optional
+import os
+from functools import lru_cache, partial
+from time import perf_counter
+from typing import List, Optional, Union
 
-from PyQt5.QtCore import QSettings, QSize, QTimer
+from PyQt5.QtCore import (QBuffer, QByteArray, QFile, QIODevice, QSize, Qt,
+                          QThreadPool, QTimer, pyqtSlot)
 from PyQt5.QtGui import QIcon, QMovie
 from PyQt5.QtWidgets import QAction, QLabel, QMainWindow, QMessageBox
 
 from smartinertia import __version__
-from smartinertia.conn_thread import ConnectionThread
+from smartinertia.conn_thread import ConnectionNotifier, ConnectionThread
 from smartinertia.connection import Connection
 from smartinertia.data import Data
 from smartinertia.dialogs import ConnectionDialog, RunDialog
 from smartinertia.graph import BarPlotWidget
+from smartinertia.save import DailyWorkbookWriter
+from smartinertia.settings import SettingsCache
 
 log = logging.getLogger(__name__)
 
 BAUD = 115200
+# milliseconds to wait for the connection thread to finish its last read
+THREAD_STOP_TIMEOUT = 200
+
+
+@lru_cache(maxsize=None)
+def window_icon() -> QIcon:
+    """Icon of the window, decoded once a QApplication exists."""
+    return QIcon("icon.png")
+
+
+@lru_cache(maxsize=None)
+def loading_gif() -> QByteArray:
+    """Contents of the connected animation, read from disk only once."""
+    gif_file = QFile("loading.gif")
+    if not gif_file.open(QIODevice.ReadOnly):
+        log.warning("Could not open loading.gif.")
+        return QByteArray()
+    gif = gif_file.readAll()
+    gif_file.close()
+    return gif
 
 
 class MainWindow(QMainWindow):
-    def __init__(self, settings: QSettings):
+    def __init__(self, settings: SettingsCache):
         super().__init__()
         self.setGeometry(50, 50, 800, 500)
         self.setMinimumSize(800, 500)
         self.setWindowTitle(f'Smart Inertia - v{__version__}')
-        self.setWindowIcon(QIcon("icon.png"))
+        self.setWindowIcon(window_icon())
 
         self.connection = None  # type: Optional[Connection]
         self.connection_port = None  # type: Optional[str]
-        self.connection_thread = None  # type: Optional[ConnectionThread]
+        self.connection_thread = None  # type: Optional[Union[ConnectionThread, ConnectionNotifier]]
+        # threads that didn't stop in time, they still use the port they were reading
+        self.stopping_threads = []  # type: List[ConnectionThread]
 
         self.settings = settings
+        self.run_writer = DailyWorkbookWriter()
 
         log.info("Initialize menu bar.")
         self._init_menu()
@@ -42,44 +71,79 @@ class MainWindow(QMainWindow):
         self.graph = BarPlotWidget(self.data)
         self.setCentralWidget(self.graph)
 
-        # periodically update graph according to new data
+        # update graph when new data arrives, at most once per frame of the screen
+        self.frame_ms = 1000 / (self.screen().refreshRate() or 60)
+        # moving average of the time a redraw takes and the least time between two redraws
+        self.draw_ms = 1.
+        self.redraw_ms = self.frame_ms
+        self.last_redraw = 0.
         self.graph_update_timer = QTimer()
-        self.graph_update_timer.timeout.connect(self.graph.update_graph)
-        self.graph_update_timer.setInterval(16)  # 60 FPS
+        self.graph_update_timer.setSingleShot(True)
+        # the timer lives in the gui thread, so the redraw can be called directly
+        self.graph_update_timer.timeout.connect(self._update_graph, Qt.DirectConnection)
 
-    def _init_menu(self):
-        menu_bar = self.menuBar()
+    def _schedule_graph_update(self):
+        """Redraw the graph for new data, batches arriving before the redraw share it."""
+        if self.graph_update_timer.isActive():
+            return
+        wait = self.redraw_ms - (perf_counter() - self.last_redraw) * 1000
+        self.graph_update_timer.start(max(0, int(wait)))
 
-        start_action = QAction('Start', self)
-        start_action.triggered.connect(self.start)
-        menu_bar.addAction(start_action)
+    @pyqtSlot()
+    def _update_graph(self):
+        """Redraw the graph and adapt the redraw interval to how long it takes."""
+        self.last_redraw = perf_counter()
+        self.graph.update_graph()
+        self.draw_ms = 0.9 * self.draw_ms + 0.1 * (perf_counter() - self.last_redraw) * 1000
 
-        stop_action = QAction('Stop', self)
-        stop_action.triggered.connect(self.stop)
-        menu_bar.addAction(stop_action)
+        # keep in sync with the frames while redraws are fast,
+        # slow redraws back off to leave at least as much time for reading the sensor
+        self.redraw_ms = max(self.frame_ms, 2 * self.draw_ms)
 
-        connection_action = QAction('Connect', self)
-        connection_action.triggered.connect(self.connect)
-        menu_bar.addAction(connection_action)
+    def _init_menu(self):
+        menu_bar = self.menuBar()
+
+        actions = []
+        for name, slot in (('Start', self.start), ('Stop', self.stop), ('Connect', self.connect)):
+            action = QAction(name, self)
+            action.triggered.connect(slot)
+            menu_bar.addAction(action)
+            actions.append(action)
+        self.start_action, self.stop_action, self.connect_action = actions
+        self._set_running(False)
 
         # add a spinning gif to show when a device is connected
-        connected_gif = QMovie("loading.gif")
-        connected_gif.start()
+        self.connected_gif_buffer = QBuffer(self)
+        self.connected_gif_buffer.setData(loading_gif())
+        self.connected_gif_buffer.open(QIODevice.ReadOnly)
+        self.connected_gif = QMovie(self.connected_gif_buffer, QByteArray(), self)
+        self.connected_gif.start()
         self.connected_label = QLabel("abc")
         self.connected_label.setMargin(1.5)
         label_size = self.connected_label.sizeHint()
-        connected_gif.setScaledSize(QSize(label_size.height(), label_size.height()))
-        self.connected_label.setMovie(connected_gif)
-        self.connected_label.hide()
+        self.connected_gif.setScaledSize(QSize(label_size.height(), label_size.height()))
+        self.connected_label.setMovie(self.connected_gif)
+        self._show_connected(False)
         menu_bar.setCornerWidget(self.connected_label)
 
+    def _show_connected(self, visible: bool):
+        """Show or hide the connected animation, it is paused while hidden to not decode frames."""
+        self.connected_gif.setPaused(not visible)
+        self.connected_label.setVisible(visible)
+
+    def _set_running(self, running: bool):
+        """Enable only the actions that can be used while a run is or isn't in progress."""
+        self.start_action.setEnabled(not running)
+        self.connect_action.setEnabled(not running)
+        self.stop_action.setEnabled(running)
+
     def start(self):
         log.info("Start button clicked!")
 
         # stop updating graph
         self.graph_update_timer.stop()
 
-        # close existing thread and connection
+        # stop existing thread, the connection is kept open for the next run
         self._close_connection()
 
         # clear data from previous run
@@ -93,53 +157,113 @@ class MainWindow(QMainWindow):
                 log.info("Connection port was not setup a second time.")
                 return
 
+        # the dialog doesn't block the event loop, the run is started once it finishes
+        self.start_action.setEnabled(False)
+        self.connect_action.setEnabled(False)
         run_dialog = RunDialog(self)
-        run_dialog.exec_()
-        if run_dialog.run_conf is None:
+        run_dialog.finished.connect(partial(self._finish_start, run_dialog))
+        run_dialog.open()
+
+    def _finish_start(self, run_dialog: RunDialog):
+        run_conf = run_dialog.run_conf
+        run_dialog.deleteLater()
+        if run_conf is None:
             log.info("Start dialog not accepted.")
+            self._set_running(False)
             return
         else:
-            self.data.set_run_conf(run_dialog.run_conf)
-
-        # setup new connection
+            self.data.set_run_conf(run_conf)
+
+        # reuse the open connection if it still matches the configuration, otherwise setup a new one
+        binary = self.settings.get('connection/binary', bool, False)
+        if self.connection is not None and (self.connection.ser.port != self.connection_port or
+                                            self.connection.binary != binary):
+            self._close_connection(force=True)
+        # two readers never share the port, a thread still reading it gets its port closed
+        self.stopping_threads = [t for t in self.stopping_threads if t.isRunning()]
+        if self.connection is not None and self.stopping_threads:
+            log.warning("Previous connection thread is still reading, reopen the connection.")
+            self._close_connection(force=True)
+        if self.connection is not None:
+            try:
+                self.connection.reset()
+            except:
+                # the device was probably reconnected since the last run, open the port again
+                log.exception(f"Connection to {self.connection_port} could not be reused!")
+                self._close_connection(force=True)
         try:
-            self.connection = Connection(self.connection_port, baud=BAUD)
-            self.connection.open()
+            if self.connection is None:
+                self.connection = Connection(self.connection_port, baud=BAUD, binary=binary)
+                self.connection.open()
         except:
-            self.connection = None
+            self._close_connection(force=True)
             QMessageBox.warning(self, "Connection failed!",
                                 "Cannot connect to flywheel!\nTry reconnecting USB and/or restarting software.")
             log.exception(f"Connection to {self.connection_port} could not be established!")
+            self._set_running(False)
             return
 
-        # ConnectionThread continuously reads from the serial port and sends incoming data to Data
-        self.connection_thread = ConnectionThread(self.connection, self.data.add_new)
+        # continuously read from the serial port and send incoming data to Data,
+        # on POSIX the port can be watched from the gui event loop so no extra thread is needed
+        if os.name == 'posix':
+            self.connection_thread = ConnectionNotifier(self.connection)
+            connection_type = Qt.DirectConnection
+        else:
+            # batches are handed to the gui thread through its event queue
+            self.connection_thread = ConnectionThread(self.connection)
+            connection_type = Qt.QueuedConnection
+        self.connection_thread.sig.connect(self.data.add_new_batch, connection_type)
+        # redraw the graph after the data is updated
+        self.connection_thread.sig.connect(self._schedule_graph_update, connection_type)
+        # queued, so the reader is not removed while it is still handling the failure
+        self.connection_thread.failed.connect(self._reader_failed, Qt.QueuedConnection)
         self.connection_thread.start()
         log.info("Connection thread started.")
 
-        # start updating graph
-        self.graph_update_timer.start()
-        self.connected_label.show()
-        if run_dialog.run_conf.target_check:
-            self.graph.add_target_line(run_dialog.run_conf.target_value)
+        self._show_connected(True)
+        self._set_running(True)
+        if run_conf.target_check:
+            self.graph.add_target_line(run_conf.target_value)
 
     def stop(self):
         log.info("Stop button clicked!")
 
-        # stop updating graph
-        self.graph_update_timer.stop()
-        self.connected_label.hide()
+        # stop updating graph, a pending redraw is done right away to show the last bars
+        if self.graph_update_timer.isActive():
+            self.graph_update_timer.stop()
+            self._update_graph()
+        self._show_connected(False)
+        self._set_running(False)
 
-        # stop and remove connection and threads
+        # stop and remove threads
         self._close_connection()
 
         # save and show report
         self.data.report()
 
+    @pyqtSlot()
+    def _reader_failed(self):
+        # a thread that was already replaced doesn't matter any more
+        if self.sender() is not self.connection_thread:
+            return
+        log.info("Connection thread failed!")
+
+        if len(self.data.raw_x):
+            # report what was measured before the connection was lost
+            self.stop()
+        else:
+            self._show_connected(False)
+            self._set_running(False)
+        # the port is opened again on the next start
+        self._close_connection(force=True)
+        QMessageBox.warning(self, "Connection lost!",
+                            "Reading from flywheel failed!\nTry reconnecting USB and/or restarting software.")
+
     def connect(self):
         log.info("Connect button clicked!")
 
-        # clear port to not interfere with new connection
+        # clear port and connection to not interfere with new connection
+        self._close_connection(force=True)
         self.connection_port = None
 
         conn_dialog = ConnectionDialog(self)
@@ -156,14 +280,25 @@ class MainWindow(QMainWindow):
             QMessageBox.warning(self, "No connection!",
                                 "No connection was established!")
 
-    def _close_connection(self):
+    def _close_connection(self, force: bool = False):
+        """Stop reading from the connection, it is also closed if force is set."""
         if self.connection_thread is not None:
             # threads are like women, you can't just tell them to stop
             # you can only suggest it and then hope for the best
             self.connection_thread.stop = True
+            # the port stays open, so the thread must be done with it before the next one starts
+            if isinstance(self.connection_thread, ConnectionThread):
+                # don't wait for the read timeout, the pending read returns with what it has
+                self.connection.cancel_read()
+                if not self.connection_thread.wait(THREAD_STOP_TIMEOUT):
+                    # keep it until it finishes, its late samples don't belong to the next run
+                    log.warning("Connection thread is still reading!")
+                    self.connection_thread.sig.disconnect()
+                    self.stopping_threads.append(self.connection_thread)
+            self.connection_thread = None
             log.info("Connection thread stopped.")
 
-        if self.connection is not None:
+        if force and self.connection is not None:
             # close and delete connection
             self.connection.close()
             self.connection = None
@@ -172,6 +307,11 @@ class MainWindow(QMainWindow):
     def closeEvent(self, a0):
         log.info("Closing window. Doing cleanup.")
         self.graph_update_timer.stop()
-        self._close_connection()
+        self._close_connection(force=True)
+        # the ports are closed, so threads still reading them fail and finish
+        for thread in self.stopping_threads:
+            thread.wait()
+        # let the background saves finish
+        QThreadPool.globalInstance().waitForDone()
         self.graph.deleteLater()
         log.info("Cleanup successful.")